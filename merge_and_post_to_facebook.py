@@ -1,14 +1,28 @@
 import os
+import re
 import random
 import cloudinary
-import cloudinary.api
-import cloudinary.uploader # For uploading the merged video
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip, concatenate_videoclips
+import cloudinary.utils # For building server-side merge URLs
+import subprocess # For running ffmpeg to merge video and audio
 import requests # For downloading from Cloudinary and posting to Facebook
+from requests.adapters import HTTPAdapter
+import urllib3 # For errors raised while streaming a download straight from response.raw
+try:
+    import av # Optional: PyAV, used to merge when the ffmpeg command-line tool isn't installed
+except ImportError:
+    av = None
+from concurrent.futures import ThreadPoolExecutor # For running the Cloudinary lookups and downloads concurrently
+from urllib.parse import unquote # For decoding file names in Cloudinary URLs
 import tempfile # For managing temporary files and directories
-import shutil   # For deleting the temporary directory
-import json     # For the posted_media_tracker.json file
+import shutil   # For deleting the temporary directory and copying downloads to disk
+import json     # For the listing cache and the legacy posted_media_tracker.json file
+import sqlite3  # For the posted media tracker database
 import sys      # To exit the script on critical errors
+import multiprocessing # For posting a batch of videos in parallel
+from fractions import Fraction # For audio timestamps when merging with PyAV
+import functools # For caching the ffmpeg encoder lookup and the tracker connection
+import threading # For guarding the Cloudinary listing cache file
+import time     # For expiring the Cloudinary listing cache
 
 # --- Cloudinary Configuration ---
 # These are loaded from GitHub Secrets (environment variables)
@@ -19,95 +33,236 @@ cloudinary.config(
     secure=True
 )
 
+# --- HTTP Session ---
+# One session for every HTTP call, so connections (and TLS handshakes) are reused
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# Read size for streaming downloads to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024 # 1 MB
+# Merged videos up to this size are uploaded to Facebook in a single request;
+# larger ones go through a resumable upload session
+FACEBOOK_SINGLE_UPLOAD_LIMIT = 50 * 1024 * 1024 # 50 MB
+
 # --- Facebook Page Details (Loaded from GitHub Secrets) ---
 PAGE_ID = os.getenv("PAGE_ID")
 FB_ACCESS_TOKEN = os.getenv("FB_ACCESS_TOKEN")
 
+# --- Required Secrets ---
+# Checked once at startup so a misconfigured run fails before any media is merged
+REQUIRED_ENV_VARS = ("CLOUDINARY_CLOUD_NAME", "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET", "PAGE_ID", "FB_ACCESS_TOKEN")
+
+# --- Server-Side Merge (Optional) ---
+# When enabled, Cloudinary overlays the music on the video itself and Facebook pulls the
+# derived URL directly, skipping the local merge and re-upload. Cloudinary renders the
+# video on the first request. The music is not looped, so a shorter track ends early.
+CLOUDINARY_SERVER_SIDE_MERGE = os.getenv("CLOUDINARY_SERVER_SIDE_MERGE", "").lower() in ("1", "true", "yes")
+
 # --- Cloudinary Folder Names ---
 # Source folder for random videos on Cloudinary
 CLOUDINARY_SOURCE_VIDEO_FOLDER = "Quotes_Videos"
 # Source folder for random background music on Cloudinary
 CLOUDINARY_SOURCE_MUSIC_FOLDER = "backmusic"
-# New folder on Cloudinary where the merged videos will be uploaded
-CLOUDINARY_MERGED_VIDEO_FOLDER = "Merged_Posts"
 
-# --- Local Tracking File ---
-# This file tracks which source videos have already been posted to Facebook
+# --- Local Tracking Database ---
+# This SQLite database tracks which source videos have already been posted to Facebook
+POSTED_MEDIA_DB = "posted_media.db"
+# Previous JSON tracker; imported into the database the first time it is created
 POSTED_MEDIA_TRACKER = "posted_media_tracker.json"
 
-# --- Supported File Extensions ---
-SUPPORTED_VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv')
-SUPPORTED_AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.aac', '.flac')
+# --- Cloudinary Listing Cache ---
+# Filtered media URLs per folder, reused across runs to skip the Cloudinary API call
+CLOUDINARY_LIST_CACHE = ".cloudinary_list_cache.json"
+# Long enough to span the 16-hour gap between scheduled runs; an exhausted source listing is re-fetched regardless
+CLOUDINARY_LIST_CACHE_TTL = 20 * 60 * 60 # Seconds (20 hours)
+# The video and music lookups run concurrently and share the cache file
+_list_cache_lock = threading.Lock()
+
+# --- Supported File Formats ---
+# Cloudinary's 'format' values (the file extension without the dot)
+SUPPORTED_VIDEO_FORMATS = frozenset({'mp4', 'avi', 'mov', 'mkv', 'webm', 'flv', 'wmv'})
+SUPPORTED_AUDIO_FORMATS = frozenset({'mp3', 'wav', 'ogg', 'aac', 'flac'})
+
+# --- Title Cleanup ---
+# Common appended IDs at the end of file names (e.g., the -123456789 in name-123456789.mp4)
+TRAILING_ID_PATTERN = re.compile(r'-\d+$')
+# Character substitutions for turning a file name into title text
+TITLE_TRANSLATION = str.maketrans({'_': ' ', '—': '-'})
+
+# --- Video Encoding ---
+# Video codecs that can be stream-copied into the MP4 output without re-encoding
+MP4_COPYABLE_VIDEO_CODECS = ('h264', 'hevc')
+# Re-encoded video must be 4:2:0 with even dimensions: High 4:2:2/4:4:4 H.264 isn't playable on
+# Facebook or most players, and 4:2:0 chroma can't cover an odd number of pixels
+EVEN_DIMENSIONS_FILTER = ['-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2']
+# H.264 encoders in order of preference when a re-encode is unavoidable.
+# Hardware encoders are much faster than libx264; libx264 is the always-available fallback.
+VIDEO_ENCODER_ARGS = {
+    'h264_videotoolbox': ['-c:v', 'h264_videotoolbox', '-b:v', '6M', *EVEN_DIMENSIONS_FILTER, '-pix_fmt', 'yuv420p'],      # macOS
+    'h264_nvenc': ['-c:v', 'h264_nvenc', '-preset', 'p4', '-b:v', '6M', *EVEN_DIMENSIONS_FILTER, '-pix_fmt', 'yuv420p'],  # NVIDIA GPUs
+    # Quick Sync takes 4:2:0 input as nv12 rather than yuv420p
+    'h264_qsv': ['-c:v', 'h264_qsv', '-preset', 'veryfast', '-b:v', '6M', *EVEN_DIMENSIONS_FILTER, '-pix_fmt', 'nv12'],   # Intel Quick Sync
+    # Software fallback; veryfast cuts encode time several-fold vs. the default medium preset.
+    # Its thread count is set per segment (see encode_video_in_segments)
+    'libx264': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', *EVEN_DIMENSIONS_FILTER, '-pix_fmt', 'yuv420p'],
+}
+# Length of the pieces a video is split into for parallel software encoding.
+# Splits happen at keyframes, so actual segments can be somewhat longer.
+ENCODE_SEGMENT_SECONDS = 10
+# CPU cores this process may use for encoding. Batch workers each get an equal share.
+ENCODE_CPU_COUNT = os.cpu_count() or 1
+# Sample rate of the AAC music track when merging with PyAV
+PYAV_AUDIO_SAMPLE_RATE = 44100
+
+def _import_legacy_tracker(conn):
+    """Copies the entries of the old JSON tracker file into the tracker database."""
+    with open(POSTED_MEDIA_TRACKER, 'r') as f:
+        try:
+            posted_media = json.load(f)
+        except json.JSONDecodeError:
+            # Handle case where file is empty or corrupted JSON
+            print(f"Warning: '{POSTED_MEDIA_TRACKER}' is empty or corrupted. Nothing to import.")
+            return
+    conn.executemany(
+        "INSERT OR IGNORE INTO posts (ts, source_video_url, source_audio_url, merged_cloudinary_url) VALUES (?, ?, ?, ?)",
+        [(item.get('timestamp'), item.get('source_video_url'), item.get('source_audio_url'), item.get('merged_cloudinary_url')) for item in posted_media]
+    )
+    print(f"Imported {len(posted_media)} entries from '{POSTED_MEDIA_TRACKER}' into '{POSTED_MEDIA_DB}'.")
+
+@functools.lru_cache(maxsize=1)
+def get_posted_media_db():
+    """
+    Returns the tracker database connection, creating the table (and importing the old JSON tracker) if needed.
+    The connection is opened once per run and shared by every lookup and save.
+    """
+    # The source video lookup runs in a worker thread, later queries on the main thread
+    conn = sqlite3.connect(POSTED_MEDIA_DB, check_same_thread=False)
+    with conn:
+        # The UNIQUE constraints also index both URL columns for fast lookups
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                ts TEXT,
+                source_video_url TEXT UNIQUE,
+                source_audio_url TEXT,
+                merged_cloudinary_url TEXT UNIQUE,
+                facebook_video_id TEXT
+            )
+        """)
+        # Databases created before Facebook video IDs were tracked lack the column
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(posts)")}
+        if 'facebook_video_id' not in columns:
+            conn.execute("ALTER TABLE posts ADD COLUMN facebook_video_id TEXT")
+        if os.path.exists(POSTED_MEDIA_TRACKER) and conn.execute("SELECT 1 FROM posts LIMIT 1").fetchone() is None:
+            _import_legacy_tracker(conn)
+    return conn
+
+def save_posted_media(video_url, audio_url, merged_cloudinary_url, facebook_video_id):
+    """
+    Saves the details of a newly posted merged video to the tracker database.
+    merged_cloudinary_url is only set for server-side merges, facebook_video_id only for direct uploads.
+    """
+    # Generate a unique ID for this post attempt (useful for debugging)
+    timestamp = os.getenv("GITHUB_RUN_ID", "local") + "_" + str(os.getenv("GITHUB_RUN_ATTEMPT", "0")) + "_" + str(os.getenv("GITHUB_JOB", "default_job"))
+    conn = get_posted_media_db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO posts (ts, source_video_url, source_audio_url, merged_cloudinary_url, facebook_video_id) VALUES (?, ?, ?, ?, ?)",
+            (timestamp, video_url, audio_url, merged_cloudinary_url, facebook_video_id)
+        )
 
-def get_posted_media():
-    """Loads the list of previously posted media details from the tracker file."""
-    if os.path.exists(POSTED_MEDIA_TRACKER):
-        with open(POSTED_MEDIA_TRACKER, 'r') as f:
+def _load_list_cache():
+    """Loads the Cloudinary listing cache file. Callers must hold _list_cache_lock."""
+    if os.path.exists(CLOUDINARY_LIST_CACHE):
+        with open(CLOUDINARY_LIST_CACHE, 'r') as f:
             try:
                 return json.load(f)
             except json.JSONDecodeError:
-                # Handle case where file is empty or corrupted JSON
-                print(f"Warning: '{POSTED_MEDIA_TRACKER}' is empty or corrupted. Starting with an empty tracker.")
-                return []
-    return []
-
-def save_posted_media(video_url, audio_url, merged_cloudinary_url):
-    """Saves the details of a newly posted merged video to the tracker file."""
-    posted_media = get_posted_media()
-    posted_media.append({
-        # Generate a unique ID for this post attempt (useful for debugging)
-        "timestamp": os.getenv("GITHUB_RUN_ID", "local") + "_" + str(os.getenv("GITHUB_RUN_ATTEMPT", "0")) + "_" + str(os.getenv("GITHUB_JOB", "default_job")),
-        "source_video_url": video_url,
-        "source_audio_url": audio_url,
-        "merged_cloudinary_url": merged_cloudinary_url
-    })
-    with open(POSTED_MEDIA_TRACKER, 'w') as f:
-        json.dump(posted_media, f, indent=4)
-
-def get_random_media_url(folder_name, resource_type, supported_extensions):
+                print(f"Warning: '{CLOUDINARY_LIST_CACHE}' is empty or corrupted. Ignoring it.")
+    return {}
+
+def get_cached_media_urls(folder_name):
+    """Returns the cached media URLs for a Cloudinary folder, or None if missing or expired."""
+    with _list_cache_lock:
+        entry = _load_list_cache().get(folder_name)
+    if entry and time.time() - entry["ts"] < CLOUDINARY_LIST_CACHE_TTL:
+        return entry["urls"]
+    return None
+
+def save_cached_media_urls(folder_name, urls):
+    """Stores the media URLs of a Cloudinary folder in the listing cache."""
+    with _list_cache_lock:
+        cache = _load_list_cache()
+        cache[folder_name] = {"ts": time.time(), "urls": urls}
+        with open(CLOUDINARY_LIST_CACHE, 'w') as f:
+            json.dump(cache, f, indent=4)
+
+def search_media_urls(folder_name, resource_type, supported_formats):
+    """
+    Lists every supported media URL in a Cloudinary folder through the Search API,
+    without duplicates, and caches the listing. Returns an empty list if nothing matched.
+    """
+    # Let Cloudinary's Search API do the filtering, so only supported files come back
+    format_expression = " OR ".join(f"format:{media_format}" for media_format in sorted(supported_formats))
+    # Match the folder and its subfolders, like the old prefix-based listing did
+    folder_expression = f'folder:"{folder_name}" OR folder:"{folder_name}/*"'
+    search = (cloudinary.Search()
+              .expression(f'({folder_expression}) AND resource_type:{resource_type} AND ({format_expression})')
+              .max_results(500)) # Largest page size the Search API allows
+
+    all_urls = []
+    next_cursor = None
+    while True:
+        # Page through the results so folders with more than 500 files are fully listed
+        if next_cursor:
+            search.next_cursor(next_cursor)
+        result = search.execute()
+        all_urls.extend(res['secure_url'] for res in result.get('resources', []))
+        next_cursor = result.get('next_cursor')
+        if not next_cursor:
+            break
+
+    if all_urls:
+        # Drop duplicates while keeping the listing order
+        all_urls = list(dict.fromkeys(all_urls))
+        save_cached_media_urls(folder_name, all_urls)
+    return all_urls
+
+def get_random_media_urls(folder_name, resource_type, supported_formats, count=1):
     """
-    Fetches a random media URL from a specified Cloudinary folder,
-    ensuring it's a supported type and, for source videos, hasn't been used before.
+    Fetches up to `count` random media URLs from a specified Cloudinary folder,
+    ensuring they're a supported type and, for source videos, distinct and not used before.
+    Returns None if no suitable media was found.
     """
     try:
-        # Fetch up to 500 resources. Adjust max_results if you have more files.
-        resources = cloudinary.api.resources(
-            type="upload", 
-            prefix=f"{folder_name}/", 
-            resource_type=resource_type,
-            max_results=500
-        )['resources']
-
-        if not resources:
-            print(f"Error: No {resource_type} files found in Cloudinary folder '{folder_name}'.")
-            return None
-
-        all_urls = []
-        for res in resources:
-            # Extract extension from secure_url for reliable filtering
-            url_path = res['secure_url'].split('?')[0] # Remove query parameters if any
-            ext = os.path.splitext(url_path)[1].lower()
-            if ext in supported_extensions:
-                all_urls.append(res['secure_url'])
-        
-        if not all_urls:
-            print(f"Warning: No supported {resource_type} files found in Cloudinary folder '{folder_name}' after filtering by URL extension.")
-            return None
+        all_urls = get_cached_media_urls(folder_name)
+        used_cache = all_urls is not None
+        if used_cache:
+            print(f"Using cached Cloudinary listing for folder '{folder_name}'.")
+        else:
+            all_urls = search_media_urls(folder_name, resource_type, supported_formats)
+            if not all_urls:
+                print(f"Error: No supported {resource_type} files found in Cloudinary folder '{folder_name}'.")
+                return None
 
         # Logic to prevent re-using source videos.
         # This prevents the *same source video* from being used again in a merge.
         if folder_name == CLOUDINARY_SOURCE_VIDEO_FOLDER:
-            posted_media = get_posted_media()
-            posted_source_video_urls = [item['source_video_url'] for item in posted_media]
-            unposted_source_urls = [url for url in all_urls if url not in posted_source_video_urls]
-            
+            posted_source_video_urls = {row[0] for row in get_posted_media_db().execute("SELECT source_video_url FROM posts")}
+            unposted_source_urls = list(set(all_urls) - posted_source_video_urls)
+
+            if not unposted_source_urls and used_cache:
+                # The cached listing may predate newly uploaded videos, so check Cloudinary before giving up
+                print(f"No unposted source videos in the cached listing; searching '{folder_name}' again.")
+                all_urls = search_media_urls(folder_name, resource_type, supported_formats)
+                unposted_source_urls = list(set(all_urls) - posted_source_video_urls)
+
             if not unposted_source_urls:
-                print(f"All unique source videos from '{CLOUDINARY_SOURCE_VIDEO_FOLDER}' have been used. Consider adding new videos or manually clearing '{POSTED_MEDIA_TRACKER}'.")
+                print(f"All unique source videos from '{CLOUDINARY_SOURCE_VIDEO_FOLDER}' have been used. Consider adding new videos or manually clearing '{POSTED_MEDIA_DB}'.")
                 return None
-            return random.choice(unposted_source_urls)
+            return random.sample(unposted_source_urls, min(count, len(unposted_source_urls)))
         
         # For music (or other types), allow reuse
-        return random.choice(all_urls)
+        return random.choices(all_urls, k=count)
     
     except Exception as e:
         print(f"Error fetching media from Cloudinary folder '{folder_name}': {e}")
@@ -117,21 +272,197 @@ def download_file(url, local_path):
     """Downloads a file from a given URL and saves it to a local path."""
     try:
         print(f"Downloading from: {url}")
-        response = requests.get(url, stream=True)
-        response.raise_for_status() # Raise an exception for HTTP errors
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        with SESSION.get(url, stream=True) as response:
+            response.raise_for_status() # Raise an exception for HTTP errors
+            # Only undoes a Content-Encoding if the server applied one; media is normally sent as-is
+            response.raw.decode_content = True
+            with open(local_path, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
         print(f"Saved to: {local_path}")
         return True
-    except requests.exceptions.RequestException as e:
+    # Reading response.raw directly raises urllib3 errors (e.g. a dropped connection) rather than requests ones,
+    # and writing to disk can raise OSError
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
         print(f"Error downloading file from {url}: {e}")
         return False
 
+def get_file_name(path_or_url):
+    """Returns the file name of a local path or URL, decoding percent-escapes (e.g. %E2%80%94) in URLs."""
+    if "://" not in path_or_url:
+        return os.path.basename(path_or_url)
+    return unquote(os.path.basename(path_or_url.split('?')[0]))
+
+def download_source_files(video_url, audio_url, download_dir):
+    """
+    Downloads the source video and audio concurrently into download_dir.
+    Returns the local video and audio paths, or (None, None) if either download fails.
+    """
+    # Keep the original file names: the post title is derived from the video's name
+    local_video_path = os.path.join(download_dir, get_file_name(video_url))
+    local_audio_path = os.path.join(download_dir, "audio_" + get_file_name(audio_url))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        video_download_future = executor.submit(download_file, video_url, local_video_path)
+        audio_download_future = executor.submit(download_file, audio_url, local_audio_path)
+        video_downloaded = video_download_future.result()
+        audio_downloaded = audio_download_future.result()
+
+    if not video_downloaded:
+        print("Failed to download source video.")
+        return None, None
+    if not audio_downloaded:
+        print("Failed to download background audio.")
+        return None, None
+    return local_video_path, local_audio_path
+
+def probe_video_codec(video_path):
+    """Returns the codec name of the first video stream (e.g. 'h264'), or None if it can't be determined."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=codec_name", "-of", "default=noprint_wrappers=1:nokey=1",
+             video_path],
+            check=True, capture_output=True, text=True
+        )
+        return result.stdout.strip() or None
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Warning: Could not probe video codec of '{video_path}': {e}")
+        return None
+
+@functools.lru_cache(maxsize=1)
+def get_available_video_encoders():
+    """Returns the H.264 encoders usable by the local ffmpeg build, best first. Queried once per run."""
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], check=True, capture_output=True, text=True)
+        # Each encoder line looks like: " V....D h264_nvenc   NVIDIA NVENC H.264 encoder"
+        listed = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Warning: Could not list ffmpeg encoders: {e}")
+        listed = set()
+
+    encoders = []
+    if sys.platform == "darwin" and 'h264_videotoolbox' in listed:
+        encoders.append('h264_videotoolbox')
+    for encoder in ('h264_nvenc', 'h264_qsv'):
+        if encoder in listed:
+            encoders.append(encoder)
+    encoders.append('libx264')
+    return encoders
+
+def get_clean_video_name(video_path):
+    """Derives a human-readable title from a video's file name or URL."""
+    original_video_basename = os.path.splitext(get_file_name(video_path))[0]
+    # Remove common appended IDs, clean for general text use in title, and
+    # ensure it doesn't end with a space after cleaning
+    return TRAILING_ID_PATTERN.sub('', original_video_basename).translate(TITLE_TRANSLATION).strip()
+
+def encode_video_in_segments(video_path, output_folder, encoder_args):
+    """
+    Re-encodes the video stream (without audio) by splitting it into segments at keyframes,
+    encoding the segments in parallel and joining the results.
+    Returns the path to the re-encoded, video-only file.
+    """
+    segment_folder = os.path.join(output_folder, "segments")
+    os.makedirs(segment_folder, exist_ok=True)
+
+    # Split without re-encoding. Matroska can hold any source codec.
+    subprocess.run(
+        ["ffmpeg", "-y", "-i", video_path, "-map", "0:v:0", "-c", "copy",
+         "-f", "segment", "-segment_time", str(ENCODE_SEGMENT_SECONDS), "-reset_timestamps", "1",
+         os.path.join(segment_folder, "source_%03d.mkv")],
+        check=True, capture_output=True, text=True
+    )
+    source_segments = sorted(os.path.join(segment_folder, name) for name in os.listdir(segment_folder) if name.startswith("source_"))
+    encoded_segments = [os.path.join(segment_folder, f"encoded_{index:03d}.mp4") for index in range(len(source_segments))]
+    print(f"  Encoding {len(source_segments)} segments in parallel...")
+
+    # Split this process's cores between the concurrent segment encodes so the
+    # ffmpeg processes together don't start more encoder threads than there are cores
+    max_workers = min(len(source_segments), ENCODE_CPU_COUNT) or 1
+    threads_per_segment = str(max(1, ENCODE_CPU_COUNT // max_workers))
+
+    def encode_segment(source_segment, encoded_segment):
+        subprocess.run(["ffmpeg", "-y", "-i", source_segment, *encoder_args, "-threads", threads_per_segment, "-an", encoded_segment],
+                       check=True, capture_output=True, text=True)
+
+    # Each worker just waits on its own ffmpeg process, so threads are enough
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(encode_segment, source_segments, encoded_segments))
+
+    # Join the encoded segments without re-encoding them again
+    segment_list_path = os.path.join(segment_folder, "segments.txt")
+    with open(segment_list_path, 'w') as f:
+        for encoded_segment in encoded_segments:
+            f.write(f"file '{encoded_segment}'\n")
+    encoded_video_path = os.path.join(output_folder, "encoded_video.mp4")
+    subprocess.run(
+        ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", segment_list_path, "-c", "copy", encoded_video_path],
+        check=True, capture_output=True, text=True
+    )
+    return encoded_video_path
+
+def merge_with_pyav(video_path, audio_path, output_path):
+    """
+    Merges with PyAV instead of the ffmpeg command-line tool. Video packets are copied as-is;
+    only the music is decoded, looped to cover the video and encoded to AAC.
+    """
+    with av.open(video_path) as video_container, av.open(output_path, 'w', options={'movflags': '+faststart'}) as output:
+        video_in = video_container.streams.video[0]
+        if video_in.codec_context.name not in MP4_COPYABLE_VIDEO_CODECS:
+            raise ValueError(f"Video codec '{video_in.codec_context.name}' can't be copied into MP4 without the ffmpeg tool.")
+        # PyAV 14 moved stream templating to add_stream_from_template()
+        if hasattr(output, 'add_stream_from_template'):
+            video_out = output.add_stream_from_template(video_in)
+        else:
+            video_out = output.add_stream(template=video_in)
+        audio_out = output.add_stream('aac', rate=PYAV_AUDIO_SAMPLE_RATE)
+        resampler = av.AudioResampler(format='fltp', layout='stereo', rate=PYAV_AUDIO_SAMPLE_RATE)
+
+        # Copy the video packets, keeping track of where the video ends. Containers like
+        # Matroska and AVI may not store packet durations, so fall back to the frame rate.
+        frame_duration = 1 / float(video_in.average_rate) if video_in.average_rate else 0.0
+        video_end = 0.0
+        for packet in video_container.demux(video_in):
+            if packet.size == 0: # Skip the empty packet that marks the end of the stream
+                continue
+            if packet.pts is not None:
+                packet_duration = float(packet.duration * packet.time_base) if packet.duration else frame_duration
+                video_end = max(video_end, float(packet.pts * packet.time_base) + packet_duration)
+            packet.stream = video_out
+            output.mux(packet)
+
+        # Decode the music from the start as often as needed to cover the whole video
+        samples_needed = int(video_end * PYAV_AUDIO_SAMPLE_RATE)
+        samples_written = 0
+        while samples_written < samples_needed:
+            samples_before_pass = samples_written
+            with av.open(audio_path) as audio_container:
+                for frame in audio_container.decode(audio=0):
+                    for resampled in resampler.resample(frame):
+                        if resampled.samples > samples_needed - samples_written:
+                            # Cut the last frame so the music ends exactly with the video
+                            samples = resampled.to_ndarray()[:, :samples_needed - samples_written]
+                            resampled = av.AudioFrame.from_ndarray(samples, format='fltp', layout='stereo')
+                            resampled.sample_rate = PYAV_AUDIO_SAMPLE_RATE
+                        if resampled.samples == 0:
+                            break
+                        resampled.pts = samples_written
+                        resampled.time_base = Fraction(1, PYAV_AUDIO_SAMPLE_RATE)
+                        samples_written += resampled.samples
+                        for packet in audio_out.encode(resampled):
+                            output.mux(packet)
+                    if samples_written >= samples_needed:
+                        break
+            if samples_written == samples_before_pass:
+                raise ValueError("The audio file contains no audio samples.")
+        for packet in audio_out.encode(None): # Flush the encoder
+            output.mux(packet)
+
 def merge_video_with_audio(video_path, audio_path, output_folder):
     """
     Merges an audio file with a video file (muting original video sound)
     and saves the combined video to the output_folder.
+    The video and audio may be local paths or URLs; ffmpeg reads URLs directly.
     Returns the path to the merged file AND the clean base name of the original video.
     """
     # Ensure the output directory exists
@@ -140,89 +471,123 @@ def merge_video_with_audio(video_path, audio_path, output_folder):
         print(f"Created output directory: {output_folder}")
 
     try:
-        print(f"\nLoading video: {os.path.basename(video_path)}")
-        video_clip = VideoFileClip(video_path)
-        
-        print(f"Loading audio: {os.path.basename(audio_path)}")
-        audio_clip = AudioFileClip(audio_path)
-
-        # Adjust audio duration to match video duration
-        if audio_clip.duration > video_clip.duration:
-            print(f"  Warning: Audio ({audio_clip.duration:.2f}s) is longer than video ({video_clip.duration:.2f}s). Trimming audio.")
-            audio_clip = audio_clip.subclip(0, video_clip.duration)
-        elif audio_clip.duration < video_clip.duration:
-            print(f"  Warning: Audio ({audio_clip.duration:.2f}s) is shorter than video ({video_clip.duration:.2f}s). Looping audio.")
-            # Loop the audio to fill the video duration
-            num_loops = int(video_clip.duration / audio_clip.duration) + 1
-            looped_audio_segments = [audio_clip] * num_loops
-            audio_clip = concatenate_videoclips(looped_audio_segments).subclip(0, video_clip.duration)
-
-        # Set the video's audio to the new audio clip (this mutes the original video sound)
-        final_clip = video_clip.set_audio(audio_clip)
-
         # Generate output filename. Clean it up for file system compatibility.
-        original_video_basename = os.path.splitext(os.path.basename(video_path))[0]
-        # Remove common appended IDs if present (e.g., -123456789.mp4 part)
-        clean_original_video_name = re.sub(r'-\d+$', '', original_video_basename)
-        
-        # Further clean for general text use in title
-        clean_original_video_name = clean_original_video_name.replace('_', ' ').replace('—', '-')
-        
-        # Ensure it doesn't end with a space after cleaning
-        clean_original_video_name = clean_original_video_name.strip() 
+        clean_original_video_name = get_clean_video_name(video_path)
 
         # Create filename for the merged output
         output_filename = f"merged_{clean_original_video_name.replace(' ', '_')}.mp4" # Replace spaces with underscores for filename
         output_path = os.path.join(output_folder, output_filename)
 
+        # Let ffmpeg swap the audio track directly: when the source codec fits in MP4 the
+        # video stream is copied as-is (no decode/re-encode), only the music is encoded to AAC.
+        def build_ffmpeg_command(video_codec_args, video_input=video_path):
+            return [
+                "ffmpeg", "-y",
+                "-i", video_input,
+                "-stream_loop", "-1", "-i", audio_path, # Loop the audio so it always covers the whole video
+                "-map", "0:v:0",                        # Video from the source clip...
+                "-map", "1:a:0",                        # ...audio from the music (mutes original video sound)
+                *video_codec_args,
+                "-c:a", "aac",
+                "-shortest",                            # Stop at the end of the video, trimming longer audio
+                # Make -shortest cut exactly at the video's end: without these the muxer's
+                # interleaving buffer can let the endlessly looped audio run past it
+                "-fflags", "+shortest", "-max_interleave_delta", "100M",
+                "-movflags", "+faststart",              # Put the index up front so the video can start playing early
+                output_path
+            ]
+
+        print(f"\nMerging video: {get_file_name(video_path)} with audio: {get_file_name(audio_path)}")
         print(f"Writing final video to: '{output_path}'")
-        # Use common codecs for wide compatibility
-        final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
 
-        # Close all clips to free up system resources
-        video_clip.close()
-        audio_clip.close()
-        final_clip.close()
+        if shutil.which("ffmpeg") is None:
+            if av is None:
+                print("Error: Neither the ffmpeg command-line tool nor PyAV is installed. Cannot merge.")
+                return None, None
+            print("  ffmpeg command-line tool not found. Merging with PyAV.")
+            merge_with_pyav(video_path, audio_path, output_path)
+            print(f"\nSuccessfully merged and saved locally: '{output_filename}'")
+            return output_path, clean_original_video_name
+
+        source_codec = probe_video_codec(video_path)
+        needs_reencode = source_codec is not None and source_codec not in MP4_COPYABLE_VIDEO_CODECS
+        if needs_reencode:
+            print(f"  Warning: Source video codec '{source_codec}' can't be copied into MP4. Re-encoding video.")
+        else:
+            try:
+                subprocess.run(build_ffmpeg_command(["-c:v", "copy"]), check=True, capture_output=True, text=True)
+            except subprocess.CalledProcessError:
+                # A known copyable codec failing is a real error; an unknown one may just need re-encoding
+                if source_codec is not None:
+                    raise
+                print("  Warning: Source video codec is unknown and stream copy failed. Re-encoding video.")
+                needs_reencode = True
+
+        if needs_reencode:
+            encoders = get_available_video_encoders()
+            for encoder in encoders:
+                print(f"  Encoding with '{encoder}'...")
+                try:
+                    if encoder == 'libx264':
+                        # Software encoding is CPU-bound, so spread it over all cores
+                        encoded_video_path = encode_video_in_segments(video_path, output_folder, VIDEO_ENCODER_ARGS[encoder])
+                        subprocess.run(build_ffmpeg_command(["-c:v", "copy"], encoded_video_path), check=True, capture_output=True, text=True)
+                    else:
+                        subprocess.run(build_ffmpeg_command(VIDEO_ENCODER_ARGS[encoder]), check=True, capture_output=True, text=True)
+                    break
+                except subprocess.CalledProcessError:
+                    # A hardware encoder can be listed by ffmpeg without the matching device being present
+                    if encoder == encoders[-1]:
+                        raise
+                    print(f"  Warning: Encoder '{encoder}' failed. Trying the next one.")
 
         print(f"\nSuccessfully merged and saved locally: '{output_filename}'")
         return output_path, clean_original_video_name # Return both path and clean name
 
+    except subprocess.CalledProcessError as e:
+        print(f"Error during video/audio merging: ffmpeg exited with code {e.returncode}")
+        print(f"ffmpeg output: {e.stderr}")
+        return None, None
     except Exception as e:
         print(f"Error during video/audio merging: {e}")
         return None, None
 
-def upload_merged_video_to_cloudinary(file_path):
-    """Uploads the locally merged video to Cloudinary."""
-    try:
-        print(f"Attempting to upload merged video: '{os.path.basename(file_path)}' to Cloudinary folder '{CLOUDINARY_MERGED_VIDEO_FOLDER}'...")
-        upload_result = cloudinary.uploader.upload(
-            file_path,
-            folder=CLOUDINARY_MERGED_VIDEO_FOLDER, # Upload to the designated merged videos folder
-            resource_type="video",                 # Explicitly specify video resource type
-            use_filename=True,                     # Use the local filename on Cloudinary
-            unique_filename=False,                 # Do not add unique suffix if filename already exists
-            overwrite=False                        # Do not overwrite if a file with the same name exists
-        )
-        print(f"Successfully uploaded merged video. Secure URL: {upload_result['secure_url']}")
-        return upload_result['secure_url']
-    except Exception as e:
-        print(f"Error uploading merged video to Cloudinary: {e}")
-        return None
+def get_public_id_from_url(url):
+    """Extracts the Cloudinary public ID (folder/name, without extension) from a delivery URL."""
+    path_parts = url.split('?')[0].split('/upload/', 1)[1].split('/')
+    # Drop the version component (e.g. v1712345678) if present
+    if path_parts[0].startswith('v') and path_parts[0][1:].isdigit():
+        path_parts = path_parts[1:]
+    return os.path.splitext('/'.join(path_parts))[0]
+
+def build_server_side_merge_url(video_url, audio_url):
+    """
+    Builds a Cloudinary URL that delivers the video with its sound replaced by the audio,
+    rendered by Cloudinary instead of locally.
+    Returns the merged URL AND the clean base name of the original video.
+    """
+    merged_url, _ = cloudinary.utils.cloudinary_url(
+        get_public_id_from_url(video_url),
+        resource_type="video",
+        format="mp4",
+        transformation=[
+            {"audio_codec": "none"}, # Mute the original video sound
+            {"overlay": {"resource_type": "audio", "public_id": get_public_id_from_url(audio_url)}},
+            {"flags": "layer_apply"}
+        ]
+    )
+    print(f"Server-side merged video URL: {merged_url}")
+    return merged_url, get_clean_video_name(video_url)
 
 def post_video_to_facebook(video_url, post_title):
     """
     Posts a video from a Cloudinary URL to the Facebook page.
     Checks if this specific merged video URL has already been posted.
     """
-    if not PAGE_ID or not FB_ACCESS_TOKEN:
-        print("Error: Facebook PAGE_ID or FB_ACCESS_TOKEN not set. Cannot post to Facebook.")
-        return False
-
     # --- NEW CHECK: Prevent re-posting the same merged video URL ---
-    posted_media = get_posted_media()
-    already_posted_merged_urls = [item['merged_cloudinary_url'] for item in posted_media if 'merged_cloudinary_url' in item]
+    already_posted = get_posted_media_db().execute("SELECT 1 FROM posts WHERE merged_cloudinary_url = ?", (video_url,)).fetchone() is not None
     
-    if video_url in already_posted_merged_urls:
+    if already_posted:
         print(f"Warning: Merged video '{video_url}' has already been posted to Facebook. Skipping.")
         return True # Return True as it's considered "posted" (already done)
     # --- END NEW CHECK ---
@@ -245,7 +610,7 @@ def post_video_to_facebook(video_url, post_title):
     print(f"Facebook Post Message: {facebook_post_message}")
 
     try:
-        response = requests.post(url, params=params)
+        response = SESSION.post(url, params=params)
         response.raise_for_status() # Raise an exception for HTTP errors (e.g., 4xx or 5xx)
         post_response = response.json()
         print("Video successfully posted to Facebook!")
@@ -257,73 +622,267 @@ def post_video_to_facebook(video_url, post_title):
             print(f"Response content: {e.response.text}") # Show full error response from Facebook
         return False
 
-if __name__ == "__main__":
-    print("--- Starting Automated Media Process for Facebook Post ---")
+def _upload_video_resumable(url, file_path, file_size, post_title):
+    """
+    Uploads a video through a resumable upload session (start, transfer the file in chunks, finish).
+    Returns the Facebook video ID, or None if Facebook doesn't confirm publishing it.
+    Raises requests exceptions on HTTP failures.
+    """
+    # Start the session. Facebook returns the session ID and the first byte range to send.
+    response = SESSION.post(url, data={
+        "upload_phase": "start",
+        "file_size": file_size,
+        "access_token": FB_ACCESS_TOKEN
+    })
+    response.raise_for_status()
+    upload_session = response.json()
+    upload_session_id = upload_session["upload_session_id"]
+    start_offset = int(upload_session["start_offset"])
+    end_offset = int(upload_session["end_offset"])
+
+    # Transfer the chunks. Facebook answers each one with the next byte range to send,
+    # so the chunks go up one after another until both offsets meet.
+    with open(file_path, 'rb') as f:
+        while start_offset < end_offset:
+            f.seek(start_offset)
+            chunk = f.read(end_offset - start_offset)
+            response = SESSION.post(
+                url,
+                data={
+                    "upload_phase": "transfer",
+                    "upload_session_id": upload_session_id,
+                    "start_offset": start_offset,
+                    "access_token": FB_ACCESS_TOKEN
+                },
+                files={"video_file_chunk": (os.path.basename(file_path), chunk)}
+            )
+            response.raise_for_status()
+            next_range = response.json()
+            start_offset = int(next_range["start_offset"])
+            end_offset = int(next_range["end_offset"])
+            print(f"  Uploaded {start_offset} of {file_size} bytes")
+
+    # Finish the session, which publishes the video with its description
+    response = SESSION.post(url, data={
+        "upload_phase": "finish",
+        "upload_session_id": upload_session_id,
+        "description": post_title,
+        "access_token": FB_ACCESS_TOKEN,
+        "privacy": '{"value":"EVERYONE"}' # Make the post publicly visible
+    })
+    response.raise_for_status()
+    finish_response = response.json()
+    print(finish_response) # Print Facebook's response for verification
+    # Facebook can answer HTTP 200 with {"success": false} when the video isn't published
+    if not finish_response.get("success"):
+        print("Error: Facebook did not confirm publishing the uploaded video.")
+        return None
+    return upload_session["video_id"]
+
+def upload_video_to_facebook(file_path, post_title):
+    """
+    Uploads a local video file to the Facebook page.
+    Returns the Facebook video ID, or None if the upload failed.
+    """
+    # Video uploads go through the graph-video host
+    url = f"https://graph-video.facebook.com/v19.0/{PAGE_ID}/videos"
+    file_size = os.path.getsize(file_path)
 
-    # Create a temporary directory for all working files (downloads, merged output)
+    print(f"\nAttempting to upload video to Facebook Page ID: {PAGE_ID}")
+    print(f"Local video file: '{os.path.basename(file_path)}' ({file_size} bytes)")
+    print(f"Facebook Post Message: {post_title}")
+
+    try:
+        if file_size <= FACEBOOK_SINGLE_UPLOAD_LIMIT:
+            # Small files go up as a single multipart request
+            with open(file_path, 'rb') as f:
+                response = SESSION.post(
+                    url,
+                    data={
+                        "description": post_title,
+                        "access_token": FB_ACCESS_TOKEN,
+                        "privacy": '{"value":"EVERYONE"}' # Make the post publicly visible
+                    },
+                    files={"source": (os.path.basename(file_path), f)}
+                )
+            response.raise_for_status()
+            post_response = response.json()
+            print(post_response) # Print Facebook's response for verification (e.g., video ID)
+            video_id = post_response["id"]
+        else:
+            video_id = _upload_video_resumable(url, file_path, file_size, post_title)
+            if video_id is None:
+                return None
+        print("Video successfully uploaded to Facebook!")
+        return video_id
+    except requests.exceptions.RequestException as e:
+        print(f"Error uploading video to Facebook: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+            print(f"Response content: {e.response.text}") # Show full error response from Facebook
+        return None
+
+def get_batch_size():
+    """
+    Reads BATCH_SIZE, the number of videos to merge and post in one run (default 1).
+    More than one are processed in parallel. Returns None if the value is invalid.
+    """
+    batch_size_value = os.getenv("BATCH_SIZE") or "1"
+    try:
+        batch_size = int(batch_size_value)
+    except ValueError:
+        batch_size = 0
+    if batch_size < 1:
+        print(f"Error: BATCH_SIZE must be a whole number of at least 1, got '{batch_size_value}'.")
+        return None
+    return batch_size
+
+def validate_configuration():
+    """
+    Checks that all required secrets are set and that the Facebook access token is accepted.
+    Returns True if the configuration is usable.
+    """
+    missing_env_vars = [name for name in REQUIRED_ENV_VARS if not os.getenv(name)]
+    if missing_env_vars:
+        print(f"Error: Required environment variables not set: {', '.join(missing_env_vars)}")
+        return False
+
+    try:
+        response = SESSION.get("https://graph.facebook.com/v19.0/me", params={"fields": "id,name", "access_token": FB_ACCESS_TOKEN})
+        response.raise_for_status()
+        print(f"Facebook access token is valid for: {response.json().get('name')}")
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"Error validating the Facebook access token: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+            print(f"Response content: {e.response.text}") # Show full error response from Facebook
+        return False
+
+def _init_batch_worker(encode_cpu_count):
+    """Limits the encoding cores of a batch worker process to its share of the machine."""
+    global ENCODE_CPU_COUNT
+    ENCODE_CPU_COUNT = encode_cpu_count
+
+def process_one(pair):
+    """
+    Merges one (source video URL, music URL) pair and posts the result to Facebook.
+    Returns (merged_cloudinary_url, facebook_video_id) on success, or None on failure.
+    Runs in a worker process when a batch of videos is posted.
+    """
+    downloaded_source_video_url, downloaded_source_audio_url = pair
+
+    # Create a temporary directory for all working files (merged output, fallback downloads)
     temp_dir = tempfile.mkdtemp()
     print(f"Temporary working directory created: {temp_dir}")
 
     # Initialize variables to track paths and URLs throughout the process
-    downloaded_source_video_url = None
-    downloaded_source_audio_url = None
     merged_local_file_path = None
     clean_video_title = None # To store the title extracted from video name
-    final_merged_cloudinary_url = None
+    final_merged_cloudinary_url = None # Only set when Cloudinary does the merge
+    facebook_video_id = None
 
     try:
-        # 1. Get a random source video URL from Cloudinary (avoiding previously posted ones)
-        downloaded_source_video_url = get_random_media_url(CLOUDINARY_SOURCE_VIDEO_FOLDER, "video", SUPPORTED_VIDEO_EXTENSIONS)
-        if not downloaded_source_video_url:
-            print("Could not get a valid source video URL from Cloudinary. Aborting.")
-            sys.exit(1)
+        if CLOUDINARY_SERVER_SIDE_MERGE:
+            # 3. Let Cloudinary render the merged video; Facebook fetches it from the derived URL
+            final_merged_cloudinary_url, clean_video_title = build_server_side_merge_url(downloaded_source_video_url, downloaded_source_audio_url)
+        else:
+            # 3. Merge the video and audio into the temporary directory. ffmpeg reads both sources
+            # straight from their Cloudinary URLs, so only the merged output touches the disk.
+            merged_local_file_path, clean_video_title = merge_video_with_audio(downloaded_source_video_url, downloaded_source_audio_url, temp_dir)
+            if not merged_local_file_path or not clean_video_title:
+                # Fall back to local copies (e.g. if this ffmpeg build can't read HTTPS inputs)
+                print("Merging from Cloudinary URLs failed. Downloading the source files and retrying.")
+                local_source_video_path, local_source_audio_path = download_source_files(downloaded_source_video_url, downloaded_source_audio_url, temp_dir)
+                if not local_source_video_path or not local_source_audio_path:
+                    print("Failed to download source files.")
+                    return None
+
+                merged_local_file_path, clean_video_title = merge_video_with_audio(local_source_video_path, local_source_audio_path, temp_dir)
+                if not merged_local_file_path or not clean_video_title:
+                    print("Video merging failed.")
+                    return None
+
+        # 4. Construct the Facebook post message
+        # Format: "Video Title #quotes #theunveiledtruth"
+        facebook_post_message = f"{clean_video_title} #quotes #theunveiledtruth"
 
-        # 2. Get a random background music URL from Cloudinary
-        downloaded_source_audio_url = get_random_media_url(CLOUDINARY_SOURCE_MUSIC_FOLDER, "video", SUPPORTED_AUDIO_EXTENSIONS)
-        if not downloaded_source_audio_url:
-            print("Could not get a valid background music URL from Cloudinary. Aborting.")
-            sys.exit(1)
+        # 5. Post the merged video to the Facebook Page
+        if CLOUDINARY_SERVER_SIDE_MERGE:
+            posted = post_video_to_facebook(final_merged_cloudinary_url, facebook_post_message)
+        else:
+            # Upload the local file straight to Facebook; no re-upload to Cloudinary needed
+            facebook_video_id = upload_video_to_facebook(merged_local_file_path, facebook_post_message)
+            posted = facebook_video_id is not None
 
-        # Determine file extensions for temporary download filenames
-        source_video_ext = os.path.splitext(downloaded_source_video_url.split('/')[-1].split('?')[0])[1].lower() or ".mp4"
-        source_audio_ext = os.path.splitext(downloaded_source_audio_url.split('/')[-1].split('?')[0])[1].lower() or ".mp3"
+        if not posted:
+            print("\nFailed to post video to Facebook.")
+            return None
+        print("\nVideo successfully posted to Facebook!")
+        return final_merged_cloudinary_url, facebook_video_id
 
-        # 3. Download source video and audio to the temporary directory
-        local_source_video_path = os.path.join(temp_dir, f"temp_source_video{source_video_ext}")
-        local_source_audio_path = os.path.join(temp_dir, f"temp_source_audio{source_audio_ext}")
+    except Exception as e:
+        print(f"\nAn unhandled error occurred while processing '{downloaded_source_video_url}': {e}")
+        return None
 
-        if not download_file(downloaded_source_video_url, local_source_video_path):
-            print("Failed to download source video. Aborting.")
-            sys.exit(1)
-        if not download_file(downloaded_source_audio_url, local_source_audio_path):
-            print("Failed to download background audio. Aborting.")
-            sys.exit(1)
+    finally:
+        # Clean up the temporary directory regardless of success or failure
+        if os.path.exists(temp_dir):
+            try:
+                shutil.rmtree(temp_dir)
+                print(f"\nCleaned up temporary directory: {temp_dir}")
+            except OSError as e:
+                print(f"Error removing temporary directory '{temp_dir}': {e}")
 
-        # 4. Merge the video and audio locally in the temporary directory
-        merged_local_file_path, clean_video_title = merge_video_with_audio(local_source_video_path, local_source_audio_path, temp_dir)
-        if not merged_local_file_path or not clean_video_title:
-            print("Video merging failed. Aborting.")
-            sys.exit(1)
+if __name__ == "__main__":
+    print("--- Starting Automated Media Process for Facebook Post ---")
 
-        # 5. Upload the locally merged video to Cloudinary
-        final_merged_cloudinary_url = upload_merged_video_to_cloudinary(merged_local_file_path)
-        if not final_merged_cloudinary_url:
-            print("Failed to upload merged video to Cloudinary. Aborting.")
+    try:
+        # 0. Fail fast on missing secrets or a rejected token, before any media is merged
+        batch_size = get_batch_size()
+        if batch_size is None or not validate_configuration():
+            print("Invalid configuration. Aborting.")
             sys.exit(1)
 
-        # 6. Construct the Facebook post message
-        # Format: "Video Title #quotes #theunveiledtruth"
-        facebook_post_message = f"{clean_video_title} #quotes #theunveiledtruth"
+        # 1. & 2. Get random source video URLs (avoiding previously posted ones) and
+        # random background music URLs from Cloudinary, both at once
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            video_urls_future = executor.submit(get_random_media_urls, CLOUDINARY_SOURCE_VIDEO_FOLDER, "video", SUPPORTED_VIDEO_FORMATS, batch_size)
+            audio_urls_future = executor.submit(get_random_media_urls, CLOUDINARY_SOURCE_MUSIC_FOLDER, "video", SUPPORTED_AUDIO_FORMATS, batch_size)
+            source_video_urls = video_urls_future.result()
+            source_audio_urls = audio_urls_future.result()
+
+        if not source_video_urls:
+            print("Could not get a valid source video URL from Cloudinary. Aborting.")
+            sys.exit(1)
+        if not source_audio_urls:
+            print("Could not get a valid background music URL from Cloudinary. Aborting.")
+            sys.exit(1)
 
-        # 7. Post the merged video (from Cloudinary) to the Facebook Page
-        if post_video_to_facebook(final_merged_cloudinary_url, facebook_post_message):
-            print("\nVideo successfully posted to Facebook!")
-            # 8. Save tracking information for the posted video
-            # Only save after successful post to avoid logging failed attempts
-            save_posted_media(downloaded_source_video_url, downloaded_source_audio_url, final_merged_cloudinary_url)
-            print(f"Posted media tracked in '{POSTED_MEDIA_TRACKER}'.")
+        # 3. - 5. Merge and post each (video, music) pair
+        pairs = list(zip(source_video_urls, source_audio_urls))
+        if len(pairs) == 1:
+            results = [process_one(pairs[0])]
         else:
-            print("\nFailed to post video to Facebook. Aborting.")
+            print(f"Processing {len(pairs)} videos in parallel...")
+            # "spawn" starts clean workers instead of forking open HTTP connections and the tracker database
+            worker_count = min(len(pairs), ENCODE_CPU_COUNT)
+            with multiprocessing.get_context("spawn").Pool(worker_count, _init_batch_worker, (max(1, ENCODE_CPU_COUNT // worker_count),)) as pool:
+                results = pool.map(process_one, pairs)
+
+        # 6. Save tracking information for the posted videos
+        # Only save after successful posts to avoid logging failed attempts.
+        # All tracker writes happen here in the main process.
+        failed_count = 0
+        for (source_video_url, source_audio_url), result in zip(pairs, results):
+            if result is None:
+                failed_count += 1
+                continue
+            final_merged_cloudinary_url, facebook_video_id = result
+            save_posted_media(source_video_url, source_audio_url, final_merged_cloudinary_url, facebook_video_id)
+        if failed_count < len(pairs):
+            print(f"Posted media tracked in '{POSTED_MEDIA_DB}'.")
+
+        if failed_count:
+            print(f"\nFailed to post {failed_count} of {len(pairs)} videos to Facebook. Aborting.")
             sys.exit(1)
 
     except Exception as main_process_error:
@@ -331,11 +890,4 @@ if __name__ == "__main__":
         sys.exit(1) # Exit with a non-zero status to indicate failure
 
     finally:
-        # 9. Clean up the temporary directory regardless of success or failure
-        if os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-                print(f"\nCleaned up temporary directory: {temp_dir}")
-            except OSError as e:
-                print(f"Error removing temporary directory '{temp_dir}': {e}")
         print("\n--- Automated Process Finished ---")